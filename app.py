@@ -1,17 +1,44 @@
 import os
+import atexit
+import ssl
 import certifi
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
 import re
-import json
+import orjson
+import logging
+import logging.handlers
 import smtplib
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 from email.message import EmailMessage
 import base64
-import traceback
-from pprint import pprint
-
+import hashlib
+import hmac
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ✅ Request threads only enqueue log records; a listener thread writes them
+#    to stderr, so a slow log pipe never holds up a response
+LOG_QUEUE = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(message)s"))
+LOG_LISTENER = logging.handlers.QueueListener(LOG_QUEUE, _log_stream)
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)  # flushes queued records on shutdown
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(message)s",
+                    handlers=[logging.handlers.QueueHandler(LOG_QUEUE)])
+log = logging.getLogger("discount")
 
 # Determine which CA bundle to use: environment override or system default
 _default_ca = os.getenv("REQUESTS_CA_BUNDLE", None)
@@ -20,10 +47,23 @@ if _default_ca and os.path.exists(_default_ca):
 else:
     CA_BUNDLE = certifi.where()
 
-print("🔒 Using CA bundle:", CA_BUNDLE, "exists?", os.path.exists(CA_BUNDLE), flush=True)
+log.info("🔒 Using CA bundle: %s exists? %s", CA_BUNDLE, os.path.exists(CA_BUNDLE))
+
+# Parse the bundle once; every pooled HTTPS connection shares this context
+SSL_CONTEXT = ssl.create_default_context(cafile=CA_BUNDLE)
+
+
+class OrjsonProvider(JSONProvider):
+    """Routes request.get_json() and jsonify() through orjson."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # ✅ Store settings
@@ -37,20 +77,314 @@ ALERT_PASSWORD = os.getenv("PASS")
 ZAPIER_WEBHOOK = os.getenv("ZAPIER_WEBHOOK")
 LOVABLE_WEBHOOK = os.getenv("LOVABLE_WEBHOOK")
 QUOTE_WEBHOOK_API_KEY = os.getenv("QUOTE_WEBHOOK_API_KEY")
+CACHE_FLUSH_SECRET = os.getenv("CACHE_FLUSH_SECRET")
+
+# Quotes can't be delivered without the webhook settings; say so once at boot
+QUOTE_WEBHOOK_MISSING = [n for n in ("LOVABLE_WEBHOOK", "QUOTE_WEBHOOK_API_KEY") if not os.getenv(n)]
+QUOTE_WEBHOOK_READY   = not QUOTE_WEBHOOK_MISSING
+QUOTE_WEBHOOK_ALERTED = False  # e-mailed once, on the first quote refused
+for _name in QUOTE_WEBHOOK_MISSING:
+    log.warning("⚠️ Env %s not set; /submit-quote will answer 500", _name)
+
+# ✅ Shopify Admin endpoints (built once, not per request)
+SHOPIFY_API      = f"https://{SHOP_NAME}/admin/api/{API_VERSION}"
+SHOP_URL         = f"{SHOPIFY_API}/shop.json"
+PRODUCT_TAGS_URL = f"{SHOPIFY_API}/products/%s.json?fields=tags"
+GRAPHQL_URL      = f"{SHOPIFY_API}/graphql.json"
+DRAFT_ORDERS_URL = f"{SHOPIFY_API}/draft_orders.json"
+JSON_HEADERS     = {"Content-Type": "application/json"}  # for orjson-encoded bodies
+
+# ✅ Other outbound endpoints
+RECAPTCHA_VERIFY_URL = "https://www.google.com/recaptcha/api/siteverify"
+LOVABLE_HEADERS      = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {QUOTE_WEBHOOK_API_KEY}",
+}
+
+# ✅ (connect, read) timeouts so a stalled upstream can't pin a worker
+SHOPIFY_TIMEOUT = (
+    float(os.getenv("SHOPIFY_CONNECT_TIMEOUT", "3.05")),
+    float(os.getenv("SHOPIFY_READ_TIMEOUT", "10")),
+)
+EXTERNAL_TIMEOUT = (SHOPIFY_TIMEOUT[0], 30)  # reCAPTCHA, file uploads, webhook
+SHOPIFY_KEEPALIVE = float(os.getenv("SHOPIFY_KEEPALIVE_SECONDS", "60"))  # 0 = off
+GRAPHQL_THROTTLE_RETRIES = 2    # GraphQL throttling is a 200, so Retry never sees it
+GRAPHQL_MAX_THROTTLE_WAIT = 5.0  # seconds
+
+# ✅ GraphQL documents (built once at import, not per request)
+PRODUCT_TAGS_QUERY = """
+query productTags($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on Product {
+      id
+      tags
+    }
+  }
+}
+"""
+
+VARIANT_EDGES_FRAGMENT = """fragment variantEdges on ProductVariantConnection {
+  edges { node { id sku price title product { title } } }
+}"""
+
+STAGED_UPLOADS_MUTATION = """
+mutation($input:[StagedUploadInput!]!){
+  stagedUploadsCreate(input:$input){
+    stagedTargets{ url resourceUrl parameters{ name value } }
+    userErrors{ field message }
+  }
+}"""
+
+FILE_CREATE_MUTATION = """
+mutation($files:[FileCreateInput!]!){
+  fileCreate(files:$files){
+    files{ id fileStatus }
+    userErrors{ field message }
+  }
+}"""
+
+# State-tax SKUs that are skipped and leave the order taxable
+IGNORED_ST = frozenset({"STCA", "STIN", "STNY", "STPA", "STTX", "STWA"})
+
+# Running-total rows from the quote sheet; dropped before any parsing
+SUBTOTAL_SKUS = frozenset({"SUBTOTAL", "SUB-TOTAL"})
+
+# Quote-sheet annotation rows ("NOTE: …", "COMMENT …", "---"); never Shopify
+# SKUs, so never looked up. The marker must be a whole word, so catalog SKUs
+# like NOTEBOOK-12 still resolve.
+ANNOTATION_RE = re.compile(r"(?:NOTE|COMMENT)(?:[:\s]|$)|---")
+
+# Cheap local checks that save a round-trip on input that can never match
+RECAPTCHA_TOKEN_RE = re.compile(r"[A-Za-z0-9_\-]{20,}")  # base64url
+SKU_RE             = re.compile(r'[^"\\]{1,255}')      # Shopify SKU limit; no quote/backslash
+
+# Global-ID prefixes; numeric ids are sliced off the end
+PRODUCT_GID_PREFIX = "gid://shopify/Product/"
+VARIANT_GID_PREFIX = "gid://shopify/ProductVariant/"
+
+class SSLContextAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections all use SSL_CONTEXT. requests would
+    otherwise hand urllib3 the CA path, which re-reads the PEM bundle for
+    every new connection.
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = SSL_CONTEXT
+        return super().init_poolmanager(*args, **kwargs)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(
+            request, verify, cert)
+        if verify is not False:
+            pool_kwargs.pop("ca_certs", None)
+            pool_kwargs.pop("ca_cert_dir", None)
+        return host_params, pool_kwargs
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if verify is not False:
+            conn.ca_certs = conn.ca_cert_dir = None
+
+
+class ShopifyRetry(Retry):
+    """
+    Backs off on throttling / 5xx (honouring Retry-After). POST stays out
+    of allowed_methods so timeouts are never replayed, but a 429 is: Shopify
+    rejects throttled calls before doing any work, so a retried draft order
+    can't be created twice.
+    """
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST":
+            return status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+# ✅ Shared Shopify session: keeps TLS connections alive between calls
+SESSION = requests.Session()
+SESSION.headers.update({"X-Shopify-Access-Token": ACCESS_TOKEN})
+SESSION.verify = CA_BUNDLE
+SESSION.mount("https://", SSLContextAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=ShopifyRetry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False,  # hand the last response back to the caller
+    ),
+))
+
+# ✅ Session for non-Shopify hosts (reCAPTCHA, staged uploads, webhook) —
+#    kept separate so the Shopify token is never sent off-shop
+EXTERNAL_SESSION = requests.Session()
+EXTERNAL_SESSION.verify = CA_BUNDLE
+EXTERNAL_SESSION.mount("https://", SSLContextAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.3,
+                      status_forcelist=[502, 503, 504],
+                      raise_on_status=False),
+))
+
+
+def shopify_keepalive():
+    """Touches Shopify periodically so the pooled TLS connection stays warm."""
+    while True:
+        time.sleep(SHOPIFY_KEEPALIVE)
+        try:
+            SESSION.head(SHOP_URL, timeout=SHOPIFY_TIMEOUT)
+        except requests.RequestException as e:
+            log.debug("keep-alive to Shopify failed: %s", e)
+
+
+if SHOPIFY_KEEPALIVE > 0:
+    threading.Thread(target=shopify_keepalive, name="shopify-keepalive", daemon=True).start()
+
+
+# ✅ Tag discounts change rarely — fresh for 5 minutes, then served stale
+#    for up to 5 more while one background refresh re-reads the tags
+DISCOUNT_CACHE = TTLCache(maxsize=4096, ttl=600)
+DISCOUNT_FRESH = TTLCache(maxsize=4096, ttl=300)  # keys not yet due a refresh
+DISCOUNT_LOCK  = threading.Lock()
+DISCOUNT_REFRESH_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="discount-refresh")
+DISCOUNT_RE    = re.compile(r"(\d+(?:\.\d+)?)%")
+NODES_BATCH    = 250  # most ids one nodes(ids:) query accepts
+CENT           = Decimal("0.01")
+
+# ✅ Resolved variants by upper-cased SKU; short TTL so price edits show up
+VARIANT_CACHE  = TTLCache(maxsize=8192, ttl=120)
+VARIANT_MISSES = TTLCache(maxsize=8192, ttl=5)  # confirmed no-match SKUs, briefly
+VARIANT_LOCK   = threading.Lock()
+
+# ✅ reCAPTCHA verdicts, kept just under Google's 2-minute token life
+RECAPTCHA_CACHE = TTLCache(maxsize=4096, ttl=110)
+RECAPTCHA_LOCK  = threading.Lock()
+RECAPTCHA_DUPLICATE = {"success": False, "error-codes": ["timeout-or-duplicate"]}  # stored for spent passes
+
+
+# ✅ One Gmail connection per process, re-used across alerts
+SMTP_LOCK = threading.Lock()
+SMTP_CONN = None
+
+
+def get_smtp():
+    """
+    Returns a logged-in Gmail connection, reconnecting when the cached one
+    no longer answers NOOP. Caller must hold SMTP_LOCK.
+    """
+    global SMTP_CONN
+    if SMTP_CONN is not None:
+        try:
+            if SMTP_CONN.noop()[0] == 250:
+                return SMTP_CONN
+        except (smtplib.SMTPException, OSError):
+            pass
+        SMTP_CONN = None
+    conn = smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=20)
+    conn.login(SENDER_EMAIL, ALERT_PASSWORD)
+    SMTP_CONN = conn
+    return conn
+
+
+@atexit.register
+def close_smtp():
+    """Says QUIT to Gmail on shutdown instead of dropping the socket."""
+    if SMTP_CONN is not None:
+        try:
+            SMTP_CONN.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
 
 
 def send_alert_email(subject, body):
+    global SMTP_CONN
     msg = EmailMessage()
     msg.set_content(body)
     msg["Subject"] = subject
     msg["From"]    = SENDER_EMAIL
     msg["To"]      = ALERT_EMAIL
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(SENDER_EMAIL, ALERT_PASSWORD)
-            smtp.send_message(msg)
+        with SMTP_LOCK:
+            try:
+                get_smtp().send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                SMTP_CONN = None  # dropped between NOOP and send — retry once
+                get_smtp().send_message(msg)
     except Exception as e:
-        print(f"❌ Failed to send alert email: {e}", flush=True)
+        log.error("❌ Failed to send alert email: %s", e)
+
+
+# ✅ Alerts queued from request handlers are mailed by a background thread
+ALERT_QUEUE = queue.Queue(maxsize=1024)
+
+
+def alert_worker():
+    while True:
+        subject, body = ALERT_QUEUE.get()
+        send_alert_email(subject, body)
+        ALERT_QUEUE.task_done()
+
+
+threading.Thread(target=alert_worker, name="alert-mailer", daemon=True).start()
+
+
+def queue_alert_email(subject, body):
+    """Hands an alert to the mailer thread so the response isn't held up by SMTP."""
+    try:
+        ALERT_QUEUE.put_nowait((subject, body))
+    except queue.Full:
+        log.error("❌ Alert queue full, dropped: %s", subject)
+
+
+# ✅ Quote webhook is delivered off the request path. Pending posts are
+#    joined at interpreter exit, but gunicorn only waits graceful_timeout
+#    (30s) before SIGKILL, so retries stop inside WEBHOOK_RETRY_WINDOW and
+#    the last-resort alert is sent from the pool thread itself
+WEBHOOK_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="quote-webhook")
+WEBHOOK_ATTEMPTS = 3         # connect errors / 5xx; waits 1s, then 2s
+WEBHOOK_RETRY_WINDOW = 15.0  # seconds; no new attempt starts after this
+
+
+def post_quote_webhook(body):
+    """
+    Delivers one quote (orjson bytes) to Lovable. Runs on WEBHOOK_POOL.
+    Connect-phase errors and 5xx are retried briefly; a read timeout is not,
+    since Lovable may already have stored the quote. A delivery that still
+    fails is e-mailed with the full payload so the quote can be re-entered.
+    """
+    deadline = time.monotonic() + WEBHOOK_RETRY_WINDOW
+    for attempt in range(1, WEBHOOK_ATTEMPTS + 1):
+        retryable = False
+        try:
+            lr = EXTERNAL_SESSION.post(
+                LOVABLE_WEBHOOK,
+                data=body,
+                headers=LOVABLE_HEADERS,
+                timeout=EXTERNAL_TIMEOUT,
+            )
+        except Exception as e:
+            log.warning("⚠️ Lovable send failed (attempt %d): %s", attempt, e)
+            failure = ("⚠️ Lovable webhook exception", str(e))
+            # never sent (or never connected) → safe to resend
+            retryable = (isinstance(e, requests.ConnectionError)
+                         and not isinstance(e, requests.ReadTimeout))
+        else:
+            log.debug("[dbg] lovable status: %s", lr.status_code)
+            log.debug("[dbg] lovable body: %.500s", lr.text)
+            if lr.ok:
+                return
+            msg = f"Lovable responded {lr.status_code}: {lr.text[:1000]}"
+            log.warning("⚠️ Lovable non-2xx (attempt %d): %s", attempt, msg)
+            failure = ("⚠️ Lovable webhook non-2xx", msg)
+            retryable = lr.status_code >= 500
+        backoff = 2 ** (attempt - 1)
+        if (not retryable or attempt == WEBHOOK_ATTEMPTS
+                or time.monotonic() + backoff > deadline):
+            break
+        time.sleep(backoff)
+    subject, msg = failure
+    # sent here, not queued: the daemon mailer may already be gone at shutdown
+    send_alert_email(subject, f"{msg}\n\nPayload:\n{body.decode()}")
 
 
 def log_captcha_v2(result: dict) -> None:
@@ -59,75 +393,321 @@ def log_captcha_v2(result: dict) -> None:
     Writes one concise line to Render logs, e.g.
     [captcha] 2025-06-18 22:07:49  ✅ PASS  host=discount.gtsimulators.com
     """
+    if not log.isEnabledFor(logging.INFO):
+        return
     stamp   = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
     status  = "✅ PASS" if result.get("success") else "❌ FAIL"
     host    = result.get("hostname", "-")
-    print(f"[captcha] {stamp}  {status}  host={host}", flush=True)
+    log.info("[captcha] %s  %s  host=%s", stamp, status, host)
+
+
+def verify_recaptcha(token):
+    """
+    siteverify result for `token`. Verdicts are remembered for a short while
+    so a token is never re-checked: a failed token can never pass later, and
+    a token that already passed is a replay, answered locally the way Google
+    would (timeout-or-duplicate).
+    """
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()  # tokens run ~500 chars
+    with RECAPTCHA_LOCK:
+        rc = RECAPTCHA_CACHE.get(key)
+    if rc is None:
+        rc = orjson.loads(EXTERNAL_SESSION.post(
+            RECAPTCHA_VERIFY_URL,
+            data={"secret": RECAPTCHA_SECRET, "response": token},
+            timeout=EXTERNAL_TIMEOUT,
+        ).content)
+        if "success" in rc:  # a real verdict; a pass is spent once returned
+            with RECAPTCHA_LOCK:
+                RECAPTCHA_CACHE[key] = RECAPTCHA_DUPLICATE if rc["success"] else rc
+    return rc
+
+
+def shopify_graphql(query, variables):
+    """
+    POSTs one GraphQL document (orjson-encoded) and returns the response.
+    A THROTTLED answer is retried once the cost bucket has refilled enough.
+    """
+    body = orjson.dumps({"query": query, "variables": variables})
+    for attempt in range(GRAPHQL_THROTTLE_RETRIES + 1):
+        resp = SESSION.post(
+            GRAPHQL_URL,
+            data=body,
+            headers=JSON_HEADERS,
+            timeout=SHOPIFY_TIMEOUT,
+        )
+        if attempt == GRAPHQL_THROTTLE_RETRIES:
+            break
+        wait = graphql_throttle_wait(resp)
+        if wait is None:
+            break
+        log.warning("⏳ GraphQL throttled, retrying in %.2fs", wait)
+        time.sleep(wait)
+    return resp
+
+
+def graphql_throttle_wait(resp):
+    """
+    Seconds until Shopify's bucket can pay for a THROTTLED query, from
+    extensions.cost.throttleStatus; None if the response wasn't throttled.
+    """
+    if resp.status_code != 200 or b"THROTTLED" not in resp.content:
+        return None  # cheap byte check keeps the normal path parse-free
+    try:
+        sj = orjson.loads(resp.content)
+        if not any((e.get("extensions") or {}).get("code") == "THROTTLED"
+                   for e in sj.get("errors") or ()):
+            return None
+    except (orjson.JSONDecodeError, AttributeError):
+        return None
+    try:
+        cost   = sj["extensions"]["cost"]
+        status = cost["throttleStatus"]
+        short  = cost["requestedQueryCost"] - status["currentlyAvailable"]
+        return min(max(short, 0) / status["restoreRate"], GRAPHQL_MAX_THROTTLE_WAIT)
+    except (KeyError, TypeError, ZeroDivisionError):
+        return 1.0  # throttled, but no usable cost info
+
+
+def parse_discount_tags(tags):
+    """Returns the first "N%" in a comma-separated tag string, else 0.0."""
+    if "%" not in tags:
+        return 0.0
+    m = DISCOUNT_RE.search(tags)  # "N%" never spans a comma, so no split
+    return float(m.group(1)) if m else 0.0
 
 
 def get_discount_from_tags(product_id):
-    headers = {"X-Shopify-Access-Token": ACCESS_TOKEN}
-    url     = f"https://{SHOP_NAME}/admin/api/{API_VERSION}/products/{product_id}.json"
-    resp    = requests.get(url, headers=headers, verify=CA_BUNDLE)
+    """REST fallback for one product; always asks Shopify, then caches."""
+    resp = SESSION.get(PRODUCT_TAGS_URL % product_id, timeout=SHOPIFY_TIMEOUT)
     if resp.status_code != 200:
-        return 0.0
-    tags = resp.json().get("product", {}).get("tags", "")
-    for t in tags.split(","):
-        m = re.search(r"(\d+(\.\d+)?)%", t.strip())
-        if m:
-            return float(m.group(1))
-    return 0.0
-
-# — fetch full variant info via GraphQL — returns dict with id and price
-def fetch_variant_info(sku: str):
-    endpoint = f"https://{SHOP_NAME}/admin/api/{API_VERSION}/graphql.json"
-    headers = {
-        "X-Shopify-Access-Token": ACCESS_TOKEN,
-        "Content-Type": "application/json"
-    }
-    query = """
-    query findVariant($sku: String!) {
-      productVariants(first: 1, query: $sku) {
-        edges {
-          node {
-            id
-            sku
-            price
-            title
-            product {
-              title
-            }
-          }
-        }
-      }
-    }
+        return 0.0  # not cached, so the next cart retries Shopify
+    try:
+        tags = orjson.loads(resp.content)["product"]["tags"]
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        tags = ""
+    pct  = parse_discount_tags(tags)
+    cache_discounts({str(product_id): pct})
+    return pct
+
+
+def cache_discounts(pcts):
+    """Stores {str(product_id): pct} and restarts each entry's fresh window."""
+    with DISCOUNT_LOCK:
+        DISCOUNT_CACHE.update(pcts)
+        DISCOUNT_FRESH.update(dict.fromkeys(pcts, True))
+
+
+# — fetch tag discounts for a whole cart in one GraphQL call —
+def get_discounts_for_products(product_ids):
     """
-    payload = {"query": query, "variables": {"sku": f'sku:"{sku}"'}}
-    resp = requests.post(endpoint, json=payload, headers=headers, verify=CA_BUNDLE)
-    if resp.status_code != 200:
-        print(f"⚠️ GraphQL error for SKU {sku}: {resp.status_code}", flush=True)
-        return None
-    edges = (
-        resp.json()
-        .get("data", {})
-        .get("productVariants", {})
-        .get("edges", [])
-    )
-    if not edges:
-        return None
-    node = edges[0]["node"]
-    if node.get("sku", "").upper() != sku.upper():
+    Returns {str(product_id): pct} for every id. Cache misses are fetched
+    together through one `nodes(ids:)` query selecting only `tags`; any
+    product missing from that response falls back to concurrent REST
+    lookups. Stale hits are answered from cache and refreshed in the
+    background.
+    """
+    keys = {str(pid) for pid in product_ids}
+    with DISCOUNT_LOCK:
+        found = {k: DISCOUNT_CACHE[k] for k in keys if k in DISCOUNT_CACHE}
+        stale = [k for k in found if k not in DISCOUNT_FRESH]
+        # marked fresh now so concurrent carts don't queue the same refresh
+        DISCOUNT_FRESH.update(dict.fromkeys(stale, True))
+    if stale:
+        DISCOUNT_REFRESH_POOL.submit(refresh_discounts, stale)
+    missing = [k for k in keys if k not in found]
+    if missing:
+        found.update(fetch_discounts(missing))
+    return found
+
+
+def refresh_discounts(keys):
+    """Background re-read of stale entries; on failure they expire as usual."""
+    try:
+        fetch_discounts(keys)
+    except requests.RequestException as e:
+        log.warning("⚠️ Discount refresh failed for %d products: %s", len(keys), e)
+
+
+def fetch_discounts(missing):
+    """Reads tag discounts for product ids (strings) from Shopify and caches them."""
+    gids  = [PRODUCT_GID_PREFIX + k for k in missing]
+    nodes = []
+    for i in range(0, len(gids), NODES_BATCH):  # Shopify caps nodes(ids:) at 250
+        resp = shopify_graphql(PRODUCT_TAGS_QUERY, {"ids": gids[i:i + NODES_BATCH]})
+        if resp.status_code != 200:
+            log.warning("⚠️ GraphQL error for product tags: %s", resp.status_code)
+            continue
+        try:
+            nodes += orjson.loads(resp.content)["data"]["nodes"] or []
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            pass  # top-level errors only; this batch falls back to REST
+
+    fetched = {}
+    for node in nodes:
+        if node and node.get("id"):
+            pid = node["id"][len(PRODUCT_GID_PREFIX):]
+            fetched[pid] = parse_discount_tags(",".join(node.get("tags") or []))
+    cache_discounts(fetched)
+
+    fallback = [k for k in missing if k not in fetched]
+    if fallback:
+        # 4 workers stays inside Shopify's REST leaky bucket
+        with ThreadPoolExecutor(max_workers=min(4, len(fallback))) as ex:
+            fetched.update(zip(fallback, ex.map(get_discount_from_tags, fallback)))
+    return fetched
+
+
+def discount_amount_str(price, pct):
+    """
+    Per-unit discount for `price` at `pct` percent, as a "0.00" string.
+    Never discounts the item below $0.01.
+    """
+    price = Decimal(str(price))
+    amt   = (price * Decimal(str(pct)) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+    if price - amt < 0:
+        amt = (price - CENT).quantize(CENT, rounding=ROUND_HALF_UP)
+    return format(amt, "f")
+
+
+def variant_info_from_node(node, sku):
+    """
+    Shapes a productVariants node into {id, price, variant_title,
+    product_title}; None unless its SKU matches exactly.
+    """
+    if (node.get("sku") or "").upper() != sku.upper():
         return None
-    gid = node["id"]  # e.g. "gid://shopify/ProductVariant/1234567890"
-    vid = int(gid.rsplit("/", 1)[-1])
     return {
-        "id": vid,
+        "id": int(node["id"][len(VARIANT_GID_PREFIX):]),
         "price": float(node["price"]),
         "variant_title": node.get("title"),
-        "product_title": node.get("product", {}).get("title"),
+        "product_title": (node.get("product") or {}).get("title"),
     }
 
 
+# — resolve many SKUs at once: one aliased GraphQL document per 50 SKUs —
+def fetch_variants_info(skus):
+    """
+    Returns {SKU.upper(): info} for every SKU that matched a variant
+    exactly (shaped by variant_info_from_node). Each SKU becomes an
+    aliased `productVariants(first: 1)` lookup, so a whole quote costs one
+    round-trip per 50 distinct SKUs instead of one per line; several
+    batches are sent concurrently. Cached hits, and misses from the last
+    few seconds, skip the network.
+    """
+    unique = {}
+    for sku in skus:
+        if sku and SKU_RE.fullmatch(sku):
+            unique.setdefault(sku.upper(), sku)
+    with VARIANT_LOCK:
+        found = {k: VARIANT_CACHE[k] for k in unique if k in VARIANT_CACHE}
+        known = found.keys() | {k for k in unique if k in VARIANT_MISSES}
+    for k in known:
+        del unique[k]
+    batches = [list(unique.values())[i:i + 50] for i in range(0, len(unique), 50)]
+
+    fetched = {}
+    if len(batches) == 1:
+        fetched.update(fetch_variant_batch(batches[0]))
+    elif batches:
+        with ThreadPoolExecutor(max_workers=min(4, len(batches))) as ex:
+            for part in ex.map(fetch_variant_batch, batches):
+                fetched.update(part)
+    with VARIANT_LOCK:
+        VARIANT_CACHE.update(fetched)
+    found.update(fetched)
+    return found
+
+
+def fetch_variant_batch(skus):
+    """One aliased productVariants query for up to 50 distinct SKUs."""
+    params = ", ".join(f"$s{i}: String!" for i in range(len(skus)))
+    fields = "\n".join(
+        f"  v{i}: productVariants(first: 1, query: $s{i}) {{ ...variantEdges }}"
+        for i in range(len(skus))
+    )
+    query = f"""
+query findVariants({params}) {{
+{fields}
+}}
+{VARIANT_EDGES_FRAGMENT}"""
+    variables = {f"s{i}": f'sku:"{sku}"' for i, sku in enumerate(skus)}
+    resp = shopify_graphql(query, variables)
+    if resp.status_code != 200:
+        log.warning("⚠️ GraphQL error for %d SKUs: %s", len(skus), resp.status_code)
+        return {}
+    try:
+        data = orjson.loads(resp.content)["data"] or {}
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        return {}  # top-level errors only; no alias is a confirmed miss
+    found  = {}
+    misses = []
+    for i, sku in enumerate(skus):
+        try:
+            edges = data[f"v{i}"]["edges"]
+        except (KeyError, TypeError):
+            continue  # alias errored; not a confirmed miss
+        info = variant_info_from_node(edges[0]["node"], sku) if edges else None
+        if info:
+            found[sku.upper()] = info
+        else:
+            misses.append(sku.upper())
+    if misses:
+        with VARIANT_LOCK:
+            VARIANT_MISSES.update(dict.fromkeys(misses, True))
+    return found
+
+
+def upload_size(f):
+    """
+    Byte size of an uploaded FileStorage without reading it: the part's
+    Content-Length if the client sent one, else an end-seek that restores
+    the stream position (fileno() would roll Werkzeug's in-memory spool
+    over to disk).
+    """
+    if f.content_length:
+        return f.content_length
+    pos  = f.stream.tell()
+    size = f.stream.seek(0, os.SEEK_END)
+    f.stream.seek(pos)
+    return size
+
+
+class UploadStream:
+    """
+    Read-only view of an upload whose `len` is the bytes still unread, as
+    MultipartEncoder expects, so it never asks the stream for fileno()
+    (which would roll Werkzeug's in-memory spool over to disk).
+    """
+    def __init__(self, f):
+        self.stream = f.stream
+        self.len    = upload_size(f)
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.len -= len(chunk)
+        return chunk
+
+
+def upload_staged_file(f, tgt):
+    """
+    POSTs one upload to its stagedUploadsCreate target and returns the
+    staged resourceUrl, which we use as the file's public link. The body is
+    streamed from Werkzeug's upload spool rather than built in memory; the
+    policy fields go first and `file` last, as GCS requires.
+    """
+    fields = [(p["name"], p["value"]) for p in tgt["parameters"]]
+    fields.append(("file", (f.filename, UploadStream(f), f.content_type)))
+    enc = MultipartEncoder(fields=fields)
+    resp_up = EXTERNAL_SESSION.post(
+        tgt["url"],
+        data=enc,
+        headers={"Content-Type": enc.content_type},
+        timeout=EXTERNAL_TIMEOUT,
+    )
+    log.debug("[dbg] upload %s → %s", f.filename, resp_up.status_code)
+    resp_up.raise_for_status()
+    return tgt["resourceUrl"]
 
 
 # ── REPLACE ONLY THIS ROUTE ───────────────────────────────────────────
@@ -139,166 +719,94 @@ def submit_quote():
     For FILE resources we treat staged `resourceUrl` as the final
     public link (Shopify 2023-10 change).
     """
+    global QUOTE_WEBHOOK_ALERTED
+    if not QUOTE_WEBHOOK_READY:  # logged at startup; refuse before any upload
+        if not QUOTE_WEBHOOK_ALERTED:
+            QUOTE_WEBHOOK_ALERTED = True
+            queue_alert_email("⚠️ Quote webhook not configured",
+                              f"Env {', '.join(QUOTE_WEBHOOK_MISSING)} not set; "
+                              "/submit-quote is refusing quotes")
+        return jsonify({"error": "Server not configured"}), 500
+
     try:
-        print("\n=== /submit-quote ==========================================")
         # ---------- 1. payload & files ----------
         if request.content_type.startswith("multipart/form-data"):
             payload_raw   = request.form.get("payload", "{}")
-            data          = json.loads(payload_raw or "{}")
+            data          = orjson.loads(payload_raw or "{}")
             uploaded      = request.files.getlist("files")
         else:
             data, uploaded = request.get_json() or {}, []
 
-        print("[dbg] keys:", list(data.keys()))
-        print("[dbg] files:", [f.filename for f in uploaded])
-
         # ---------- 2. reCAPTCHA ----------
         token = data.get("recaptcha_token")
         if not token:
             return jsonify({"error": "missing recaptcha_token"}), 400
+        if not RECAPTCHA_TOKEN_RE.fullmatch(str(token)):
+            return jsonify({"error": "recaptcha failed"}), 400
 
-        rc = requests.post(
-            "https://www.google.com/recaptcha/api/siteverify",
-            data={"secret": RECAPTCHA_SECRET, "response": token},
-            verify=CA_BUNDLE
-        ).json()
+        rc = verify_recaptcha(token)
 
         log_captcha_v2(rc)               # ← ADD THIS LINE
 
         if not rc.get("success"):
             # (optional) e-mail yourself on failure
-            send_alert_email("⚠️ Bad reCAPTCHA", json.dumps(rc, indent=2))
+            queue_alert_email("⚠️ Bad reCAPTCHA", orjson.dumps(rc, option=orjson.OPT_INDENT_2).decode())
             return jsonify({"error": "recaptcha failed"}), 400
 
 
         file_urls = []
         if uploaded:
-            gql = f"https://{SHOP_NAME}/admin/api/{API_VERSION}/graphql.json"
-            hdr = {
-                "X-Shopify-Access-Token": ACCESS_TOKEN,
-                "Content-Type": "application/json"
-            }
-
             # ---------- 3. stagedUploadsCreate ----------
             inputs = [{
                 "filename"  : f.filename,
                 "mimeType"  : f.content_type,
-                "fileSize"  : str(f.seek(0, 2) or f.tell()),  # str!
+                "fileSize"  : str(upload_size(f)),  # str!
                 "httpMethod": "POST",
                 "resource"  : "FILE"
             } for f in uploaded]
-            for f in uploaded: f.seek(0)
 
-            staged_q = """
-              mutation($input:[StagedUploadInput!]!){
-                stagedUploadsCreate(input:$input){
-                  stagedTargets{ url resourceUrl parameters{ name value } }
-                  userErrors{ field message }
-                }
-              }"""
-            sj = requests.post(gql, headers=hdr,
-                               json={"query": staged_q,
-                                     "variables":{"input":inputs}},
-                               verify=CA_BUNDLE).json()
+            sj = orjson.loads(shopify_graphql(STAGED_UPLOADS_MUTATION,
+                                              {"input": inputs}).content)
             if sj.get("errors"):
-                print("[dbg] staged transport errors:", sj["errors"])
+                log.warning("⚠️ stagedUploadsCreate errors: %s", sj["errors"])
                 return jsonify({"error":"stagedUploadsCreate transport"}), 500
-            ue = sj["data"]["stagedUploadsCreate"]["userErrors"]
-            if ue:
-                print("[dbg] staged userErrors:", ue)
+            staged = sj["data"]["stagedUploadsCreate"]
+            if staged["userErrors"]:
+                log.warning("⚠️ stagedUploadsCreate userErrors: %s", staged["userErrors"])
                 return jsonify({"error":"stagedUploadsCreate userErrors"}), 500
-            targets = sj["data"]["stagedUploadsCreate"]["stagedTargets"]
-
-            # ---------- 4. POST each file ----------
-            for f, tgt in zip(uploaded, targets):
-                fields = {p["name"]: p["value"] for p in tgt["parameters"]}
-                resp_up = requests.post(
-                    tgt["url"],
-                    data=fields,
-                    files={"file": (f.filename, f, f.content_type)}
-                )
-                print(f"[dbg] upload {f.filename} → {resp_up.status_code}")
-                resp_up.raise_for_status()
-
-                # ---------- 5. fileCreate ----------
-                fc_q = """
-                  mutation($files:[FileCreateInput!]!){
-                    fileCreate(files:$files){
-                      files{ id fileStatus }
-                      userErrors{ field message }
-                    }
-                  }"""
-                fc_vars = {"files":[{
-                    "originalSource": tgt["resourceUrl"],
-                    "contentType"   : "FILE"
-                }]}
-                fc = requests.post(gql, headers=hdr,
-                                   json={"query":fc_q,"variables":fc_vars},
-                                   verify=CA_BUNDLE).json()
-                if fc.get("errors") or fc["data"]["fileCreate"]["userErrors"]:
-                    print("[dbg] fileCreate issue:", fc)
-                    return jsonify({"error":"fileCreate failed"}), 500
-
-                # Use staged resourceUrl as the public link
-                file_urls.append(tgt["resourceUrl"])
+            targets = staged["stagedTargets"]
+
+            # ---------- 4. POST all files in parallel ----------
+            with ThreadPoolExecutor(max_workers=min(8, len(uploaded))) as ex:
+                file_urls = list(ex.map(upload_staged_file, uploaded, targets))
+
+            # ---------- 5. fileCreate (one mutation for every file) ----------
+            fc_vars = {"files":[{
+                "originalSource": url,
+                "contentType"   : "FILE"
+            } for url in file_urls]}
+            fc = orjson.loads(shopify_graphql(FILE_CREATE_MUTATION, fc_vars).content)
+            if fc.get("errors") or fc["data"]["fileCreate"]["userErrors"]:
+                log.warning("⚠️ fileCreate issue: %s", fc)
+                return jsonify({"error":"fileCreate failed"}), 500
 
         # ---------- 6. Lovable Webhook (main & only) ----------
         zap_payload = {
             "product_list" : data.get("product_list", []),
             "customer_info": data.get("customer_info", []),
-            "created_at"   : datetime.utcnow().isoformat(),
+            "created_at"   : datetime.utcnow(),  # orjson writes ISO 8601 + "Z"
             "file_urls"    : file_urls,
         }
 
-        if not LOVABLE_WEBHOOK:
-            msg = "Env LOVABLE_WEBHOOK not set"
-            print("[dbg] lovable missing:", msg, flush=True)
-            send_alert_email("⚠️ LOVABLE_WEBHOOK missing", msg)
-            return jsonify({"error": "Server not configured"}), 500
-
-        if not QUOTE_WEBHOOK_API_KEY:
-            msg = "Env QUOTE_WEBHOOK_API_KEY not set"
-            print("[dbg] lovable api key missing:", msg, flush=True)
-            send_alert_email("⚠️ QUOTE_WEBHOOK_API_KEY missing", msg)
-            return jsonify({"error": "Server not configured"}), 500
-
-        headers_json = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {QUOTE_WEBHOOK_API_KEY}",
-        }
+        body = orjson.dumps(zap_payload, option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z)
+        WEBHOOK_POOL.submit(post_quote_webhook, body)
 
-        try:
-            lr = requests.post(
-                LOVABLE_WEBHOOK,
-                json=zap_payload,
-                headers=headers_json,
-                verify=CA_BUNDLE,
-            )
-            print("[dbg] lovable status:", lr.status_code, flush=True)
-            print("[dbg] lovable body:", lr.text[:500], flush=True)
-
-            if not lr.ok:
-                msg = f"Lovable responded {lr.status_code}: {lr.text[:1000]}"
-                print("[dbg] lovable non-2xx:", msg, flush=True)
-                send_alert_email("⚠️ Lovable webhook non-2xx", msg)
-                return jsonify({
-                    "error": "Lovable webhook failed",
-                    "status": lr.status_code,
-                    "body": lr.text[:200],
-                }), 502
-
-        except Exception as e:
-            print("[dbg] lovable send failed (exception):", e, flush=True)
-            send_alert_email("⚠️ Lovable webhook exception", f"{e}")
-            return jsonify({"error": "Lovable webhook failed"}), 502
-
-        print("[dbg] done OK; urls:", file_urls, flush=True)
+        log.debug("[dbg] done OK; urls: %s", file_urls)
         return jsonify({"success": True}), 200
 
 
     except Exception as exc:
-        print("❌ fatal:", exc)
-        traceback.print_exc()
+        log.exception("❌ fatal: %s", exc)
         return jsonify({"error":"Internal server error"}), 500
 # ───────────────────────────────────────────────────────────────────────
 
@@ -314,28 +822,22 @@ def create_draft_order():
     items = data.get("items", [])                          # CHANGED (from request.get_json()...)
     attrs = data.get("attributes", {}) or {}               # NEW
 
-    line_items = []
-    for i in items:
-        pid  = i["product_id"]
-        price = float(i["price"])
-        vid  = i["variant_id"]
-        qty  = i["quantity"]
-        pct  = get_discount_from_tags(pid)
-        amt  = round(price * pct / 100, 2)
-        if price - amt < 0:
-            amt = price - 0.01
-        line_items.append(
-            {
-                "variant_id": vid,
-                "quantity": qty,
-                "applied_discount": {
-                    "description": "GT DISCOUNT",
-                    "value_type": "fixed_amount",
-                    "value": f"{amt:.2f}",
-                    "amount": f"{amt:.2f}",
-                },
-            }
-        )
+    discounts = get_discounts_for_products(i["product_id"] for i in items)
+
+    line_items = [
+        {
+            "variant_id": i["variant_id"],
+            "quantity": i["quantity"],
+            "applied_discount": {
+                "description": "GT DISCOUNT",
+                "value_type": "fixed_amount",
+                "value": amt,
+                "amount": amt,
+            },
+        }
+        for i in items
+        for amt in (discount_amount_str(i["price"], discounts[str(i["product_id"])]),)
+    ]
 
     # NEW: convert to REST note_attributes
     note_attributes = [
@@ -352,23 +854,23 @@ def create_draft_order():
         }
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "X-Shopify-Access-Token": ACCESS_TOKEN,
-    }
-    resp = requests.post(
-        f"https://{SHOP_NAME}/admin/api/{API_VERSION}/draft_orders.json",
-        headers=headers,
-        json=payload,
-        verify=CA_BUNDLE,
+    resp = SESSION.post(
+        DRAFT_ORDERS_URL,
+        data=orjson.dumps(payload),
+        headers=JSON_HEADERS,
+        timeout=SHOPIFY_TIMEOUT,
     )
 
     if 200 <= resp.status_code < 300:
-        invoice_url = resp.json().get("draft_order", {}).get("invoice_url")
+        try:
+            invoice_url = orjson.loads(resp.content)["draft_order"]["invoice_url"]
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            invoice_url = None
         return jsonify({"checkout_url": invoice_url}), 200
 
-    send_alert_email("⚠️ Website Draft Order Failed", f"{resp.status_code} {resp.text}")
-    return jsonify({"error": "Failed", "details": resp.text}), 500
+    details = resp.text  # decoded once for the alert and the client
+    queue_alert_email("⚠️ Website Draft Order Failed", f"{resp.status_code} {details}")
+    return jsonify({"error": "Failed", "details": details}), 500
 
 
 
@@ -376,9 +878,31 @@ def create_draft_order():
 # ───────────────────────────────────────────────────────────────────────
 
 
+def classify_method_row(sku, sku_upper, qty, disc, quote_number):
+    """
+    Tags a quote-sheet row as "shipping", "discount", "tax", "skip" (blank
+    SKU at $0, or zero quantity), "custom" (blank SKU with a price, or an
+    annotation row; never looked up) or "variant".
+    """
+    if sku_upper.startswith("S&H") and quote_number:
+        return "shipping"
+    if disc < 0:
+        return "discount"
+    if sku_upper.startswith("ST"):
+        return "tax"
+    if (not sku and disc == 0) or qty == 0:
+        return "skip"
+    if not sku or ANNOTATION_RE.match(sku_upper):
+        return "custom"
+    return "variant"
+
+
 @app.route("/create-draft-from-method", methods=["POST"])
 def create_draft_from_method():
-    data        = request.get_json()
+    try:
+        data    = orjson.loads(request.get_data(cache=False) or b"{}")
+    except orjson.JSONDecodeError:
+        return jsonify({"error": "Invalid JSON"}), 400
     items       = data.get("product_list", [])
     quote_info  = data.get("quote_info", [])
 
@@ -401,22 +925,29 @@ def create_draft_from_method():
     any_st_seen           = False    # track if ANY ST (ignored or not) appeared
     any_variant_matched   = False    # track if any SKU matched a Shopify variant
 
-    ignored_st = {"STCA", "STIN", "STNY", "STPA", "STTX", "STWA"}
-
+    # Coerce and classify every row once: (sku, SKU, qty, disc, kind);
+    # subtotal rows are dropped here, before their qty/disc are parsed
+    rows = []
     for it in items:
-        sku_raw = it.get("sku", "").strip()
-        sku     = sku_raw
-        qty     = int(it.get("qty", 1))
-        disc    = float(it.get("disc", "0").replace(",", ""))
-
-        sku_upper = sku_raw.upper()
-
-        # Skip subtotal rows
-        if sku_upper in ("SUBTOTAL", "SUB-TOTAL"):
+        sku       = (it.get("sku") or "").strip()
+        sku_upper = sku.upper()
+        if sku_upper in SUBTOTAL_SKUS:
             continue
+        qty  = it.get("qty")
+        qty  = 1 if qty is None or qty == "" else int(qty)  # explicit 0 stays 0
+        disc = float(str(it.get("disc", "0")).replace(",", ""))
+        kind = classify_method_row(sku, sku_upper, qty, disc, quote_number)
+        if kind != "skip":
+            rows.append((sku, sku_upper, qty, disc, kind))
+
+    # Resolve every SKU that will need a variant in one batched lookup
+    variants = fetch_variants_info(
+        [sku for sku, _, _, _, kind in rows if kind == "variant"]
+    )
 
+    for sku, sku_upper, qty, disc, kind in rows:
         # Shipping line
-        if sku_upper.startswith("S&H") and quote_number:
+        if kind == "shipping":
             shipping_line = {
                 "title": f"QUOTE # {quote_number}",
                 "custom": True,
@@ -425,14 +956,14 @@ def create_draft_from_method():
             continue
 
         # Negative price → order-level discount
-        if disc < 0:
+        if kind == "discount":
             order_discount_total += abs(disc)
             continue
 
         # ST-prefixed logic
-        if sku_upper.startswith("ST"):
+        if kind == "tax":
             any_st_seen = True
-            if sku_upper in ignored_st:
+            if sku_upper in IGNORED_ST:
                 continue  # ignored state codes – taxable
             tax_exempt = True   # other ST codes → non-taxable order
             line_items.append(
@@ -446,11 +977,7 @@ def create_draft_from_method():
             )
             continue
 
-        # Blank SKU with zero price → ignore
-        if not sku and disc == 0:
-            continue
-
-        info = fetch_variant_info(sku)
+        info = variants.get(sku_upper) if kind == "variant" else None
 
         # Unrecognized SKU → custom item
         if not info:
@@ -497,21 +1024,20 @@ def create_draft_from_method():
         if discount_amount < 0:
             discount_amount = 0.0
 
-        line_items.append(
-            {
-                "variant_id": info["id"],
-                "quantity":   qty,
-                "price":      f"{base_price:.2f}",
-                **( {
-                    "applied_discount": {
-                        "description": "GT DISCOUNT",
-                        "value_type":  "fixed_amount",
-                        "value":       f"{discount_amount:.2f}",
-                        "amount":      f"{discount_amount:.2f}",
-                    }
-                } if discount_amount > 0 else {} ),
+        variant_item = {
+            "variant_id": info["id"],
+            "quantity":   qty,
+            "price":      f"{base_price:.2f}",
+        }
+        if discount_amount > 0:
+            amt = f"{discount_amount:.2f}"  # formatted once for value + amount
+            variant_item["applied_discount"] = {
+                "description": "GT DISCOUNT",
+                "value_type":  "fixed_amount",
+                "value":       amt,
+                "amount":      amt,
             }
-        )
+        line_items.append(variant_item)
 
 
 
@@ -531,33 +1057,56 @@ def create_draft_from_method():
     if shipping_line:
         draft_body["shipping_line"] = shipping_line
     if order_discount_total > 0:
+        total = f"{order_discount_total:.2f}"
         draft_body["applied_discount"] = {
             "description": "GT Discount",
             "value_type":  "fixed_amount",
-            "value":       f"{order_discount_total:.2f}",
-            "amount":      f"{order_discount_total:.2f}",
+            "value":       total,
+            "amount":      total,
         }
     if tax_exempt:
         draft_body["tax_exempt"] = True
 
     payload = {"draft_order": draft_body}
-    headers = {
-        "Content-Type": "application/json",
-        "X-Shopify-Access-Token": ACCESS_TOKEN,
-    }
-    resp = requests.post(
-        f"https://{SHOP_NAME}/admin/api/{API_VERSION}/draft_orders.json",
-        headers=headers,
-        json=payload,
-        verify=CA_BUNDLE,
+    resp = SESSION.post(
+        DRAFT_ORDERS_URL,
+        data=orjson.dumps(payload),
+        headers=JSON_HEADERS,
+        timeout=SHOPIFY_TIMEOUT,
     )
 
     if 200 <= resp.status_code < 300:
-        invoice_url = resp.json().get("draft_order", {}).get("invoice_url")
+        try:
+            invoice_url = orjson.loads(resp.content)["draft_order"]["invoice_url"]
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            invoice_url = None
         return jsonify({"checkout_url": invoice_url}), 200
 
-    send_alert_email("⚠️ Method Draft Failed", f"{resp.status_code} {resp.text}")
-    return jsonify({"error": "Failed", "details": resp.text}), 500
+    details = resp.text  # decoded once for the alert and the client
+    queue_alert_email("⚠️ Method Draft Failed", f"{resp.status_code} {details}")
+    return jsonify({"error": "Failed", "details": details}), 500
+
+
+@app.route("/cache/flush", methods=["POST"])
+def flush_cache():
+    """
+    Drops cached tag discounts and variants so merchandiser edits apply
+    immediately. The caches live in the process, which is why render.yaml
+    runs a single (multi-threaded) gunicorn worker.
+    Requires the X-Cache-Secret header to match env CACHE_FLUSH_SECRET.
+    """
+    supplied = request.headers.get("X-Cache-Secret", "").encode()  # bytes: any header is comparable
+    if not CACHE_FLUSH_SECRET or not hmac.compare_digest(supplied, CACHE_FLUSH_SECRET.encode()):
+        return jsonify({"error": "forbidden"}), 403
+    with DISCOUNT_LOCK:
+        flushed = len(DISCOUNT_CACHE)
+        DISCOUNT_CACHE.clear()
+        DISCOUNT_FRESH.clear()
+    with VARIANT_LOCK:
+        flushed += len(VARIANT_CACHE)
+        VARIANT_CACHE.clear()
+        VARIANT_MISSES.clear()
+    return jsonify({"flushed": flushed}), 200
 
 
 @app.route("/ping", methods=["GET"])
@@ -566,4 +1115,4 @@ def ping():
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=False)